@@ -7,24 +7,120 @@ A privacy-focused computer vision system that detects and tracks people using we
 creating a local database with organized folders for each unique individual.
 
 Requirements:
-- opencv-python
+- opencv-contrib-python
 - face-recognition
 - numpy
 - pillow
 
-Install with: pip install opencv-python face-recognition numpy pillow
+Install with: pip install opencv-contrib-python face-recognition numpy pillow
 """
 
+import argparse
 import cv2
+import dlib
 import face_recognition
 import numpy as np
 import os
 import json
+import platform
+import queue
+import threading
 import time
 from datetime import datetime
 from typing import List, Dict, Tuple, Optional
 import logging
 
+try:
+    from numba import njit, prange
+except ImportError:  # numba is optional, identification then falls back to NumPy/BLAS
+    njit = None
+
+try:
+    import hnswlib
+except ImportError:  # hnswlib is optional, identification then always scans linearly
+    hnswlib = None
+
+# Length of the face embeddings produced by face_recognition
+ENCODING_DIM = 128
+
+# Number of metadata events appended to the log between full metadata snapshots
+SNAPSHOT_EVERY = 100
+
+# Known persons needed before identification switches to an approximate
+# nearest neighbor index; below this a linear scan is faster
+ANN_MIN_PERSONS = 200
+
+if njit is not None:
+    @njit('f4[:, ::1](f4[:, ::1], f4[:, ::1])', fastmath=True, parallel=True, cache=True)
+    def _squared_distances(known, encodings):
+        """Squared euclidean distances between (N, D) known faces and (M, D) encodings."""
+        count, batch, dim = known.shape[0], encodings.shape[0], known.shape[1]
+        distances_sq = np.empty((count, batch), dtype=np.float32)
+        for i in prange(count):
+            for j in range(batch):
+                acc = np.float32(0.0)
+                for k in range(dim):
+                    diff = known[i, k] - encodings[j, k]
+                    acc += diff * diff
+                distances_sq[i, j] = acc
+        return distances_sq
+else:
+    _squared_distances = None
+
+class FrameGrabber:
+    """Reads frames on a dedicated thread, keeping only the most recent one."""
+    
+    def __init__(self, cap: cv2.VideoCapture):
+        self.cap = cap
+        self.alive = False
+        self.failed = False
+        self._latest = None
+        self._frame_id = 0
+        self._condition = threading.Condition()
+        self._thread = None
+    
+    def start(self):
+        """Start grabbing frames in the background."""
+        self.alive = True
+        self._thread = threading.Thread(target=self.run, name="frame-grabber", daemon=True)
+        self._thread.start()
+    
+    def run(self):
+        """Grabber thread: overwrite the latest frame as fast as the camera delivers."""
+        while self.alive:
+            ret, frame = self.cap.read()
+            with self._condition:
+                if ret:
+                    self._latest = frame
+                    self._frame_id += 1
+                else:
+                    self.failed = True
+                    self.alive = False
+                self._condition.notify_all()
+    
+    def read(self, last_frame_id: int, timeout: float = 0.5) -> Tuple[Optional[np.ndarray], int]:
+        """Wait for a frame newer than last_frame_id and return it with its id.
+        
+        Returns (None, last_frame_id) if no new frame arrived within timeout
+        or the camera failed.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._frame_id != last_frame_id or not self.alive, timeout)
+            if self._frame_id == last_frame_id:
+                return None, last_frame_id
+            return self._latest, self._frame_id
+    
+    def stop(self, timeout: float = 2.0) -> bool:
+        """Stop the grabber thread; return False if it is still stuck in cap.read()."""
+        self.alive = False
+        if self._thread is not None:
+            # A stalled or unplugged camera can block cap.read() indefinitely
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                return False
+            self._thread = None
+        return True
+
 class PersonTracker:
     def __init__(self, 
                  camera_id: int = 0,
@@ -33,51 +129,224 @@ class PersonTracker:
                  similarity_threshold: float = 0.6,
                  min_face_size: Tuple[int, int] = (50, 50),
                  detection_confidence: float = 0.8,
-                 face_detection_model: str = "hog"):
+                 face_detection_model: str = "auto",
+                 detection_scale: float = 0.5,
+                 require_simd_dlib: bool = True,
+                 detect_every: int = 5):
         """
         Initialize the Person Tracker system.
         
         Args:
+            camera_id: Index of the webcam to open
             database_path: Path to store person folders
             update_interval: Time in seconds between image updates for same person
             similarity_threshold: Face similarity threshold (lower = more strict)
             min_face_size: Minimum face size to detect (width, height)
             detection_confidence: Minimum confidence for face detection
+            face_detection_model: Face detection model to use ('hog', 'cnn', or 'auto'
+                to use 'cnn' when dlib was built with CUDA and 'hog' otherwise)
+            detection_scale: Factor the frame is resized by before face detection
+            require_simd_dlib: Refuse to start if dlib was built without AVX/NEON
+            detect_every: Run face detection on every N-th frame, track boxes in between
         """
+        self.camera_id = camera_id
         self.database_path = database_path
         self.update_interval = update_interval
         self.similarity_threshold = similarity_threshold
         self.min_face_size = min_face_size
         self.detection_confidence = detection_confidence
+        self.face_detection_model = face_detection_model
+        if detection_scale <= 0:
+            raise ValueError(f"detection_scale must be positive, got {detection_scale}")
+        self.detection_scale = detection_scale
+        self.detect_every = max(1, detect_every)
         
         # Initialize tracking variables
-        self.known_faces = []
+        # Known encodings live in a preallocated float32 matrix; only the first
+        # len(known_names) rows are valid, see the known_faces property.
+        # Their squared norms are cached for the distance expansion.
+        self._known_matrix = np.empty((16, ENCODING_DIM), dtype=np.float32)
+        self._known_sq_norms = np.empty(16, dtype=np.float32)
+        # HNSW index over the same rows, built once ANN_MIN_PERSONS are known
+        self._ann_index = None
         self.known_names = []
         self.person_count = 0
         self.last_update_time = {}
         self.person_metadata = {}
         
+        # Metadata changes are appended to events.jsonl and folded into
+        # metadata.json every SNAPSHOT_EVERY events and on cleanup
+        self._events_file = None
+        self._events_since_snapshot = 0
+        # Every event gets a sequence number; the snapshot stores the last one it
+        # covers so replay can skip events the snapshot already contains
+        self._event_seq = 0
+        # Events come from both the detection and the image writer threads
+        self._metadata_lock = threading.RLock()
+        
+        # Detection runs on a worker thread; both queues hold only the latest item
+        self._frame_queue = queue.Queue(maxsize=1)
+        self._result_queue = queue.Queue(maxsize=1)
+        self._stop_event = threading.Event()
+        self._detection_thread = None
+        
+        # Face crops are JPEG-encoded and written to disk by a separate writer thread
+        self._save_queue = queue.Queue(maxsize=32)
+        self._writer_thread = None
+        
+        # Between detections, face boxes are advanced by OpenCV trackers, kept as
+        # (person_id, tracker) pairs since two boxes may match the same person
+        self.frame_idx = 0
+        self._trackers = []
+        
+        # Frame-sized buffers reused across frames instead of allocating per frame:
+        # the downscaled BGR, grayscale and RGB copies for detection and the preview canvas
+        self._small_buf = None
+        self._gray_buf = None
+        self._rgb_buf = None
+        self._display_buf = None
+        
         # Setup logging
         logging.basicConfig(level=logging.INFO, 
                           format='%(asctime)s - %(levelname)s - %(message)s')
         self.logger = logging.getLogger(__name__)
         
+        # Check the dlib build before doing any slow work
+        self._check_dlib_build(require_simd_dlib)
+        
+        # Run the CNN (MMOD) detector on the GPU when dlib can, otherwise HOG on the CPU
+        if self.face_detection_model == "auto":
+            self.face_detection_model = "cnn" if getattr(dlib, "DLIB_USE_CUDA", False) else "hog"
+            self.logger.info(f"Selected face detection model: {self.face_detection_model}")
+        
+        # HOG only looks at gradients, so it is run directly on grayscale frames
+        self._hog_detector = dlib.get_frontal_face_detector() if self.face_detection_model == "hog" else None
+        
+        # Start numba's thread pool now rather than on the first detected face
+        if _squared_distances is not None:
+            _squared_distances(np.zeros((1, ENCODING_DIM), dtype=np.float32),
+                               np.zeros((1, ENCODING_DIM), dtype=np.float32))
+        
         # Create database directory
         os.makedirs(database_path, exist_ok=True)
         
         # Load existing database
         self._load_existing_database()
         
+        # Open the event log, folding in any events replayed from a previous run
+        self._events_file = open(os.path.join(database_path, "events.jsonl"), 'a', buffering=1)
+        if self._events_since_snapshot:
+            self._save_metadata()
+        
         # Initialize camera
         self.cap = None
+        self._grabber = None
         self._initialize_camera()
     
+    @property
+    def known_faces(self) -> np.ndarray:
+        """Encodings of all known persons as an (N, 128) float32 array."""
+        return self._known_matrix[:len(self.known_names)]
+    
+    def _add_known_face(self, face_encoding: np.ndarray, person_id: str):
+        """Append an encoding to the known faces matrix, growing it if needed."""
+        count = len(self.known_names)
+        if count == len(self._known_matrix):
+            # Double the capacity so appends stay amortized O(1)
+            grown = np.empty((2 * count, ENCODING_DIM), dtype=np.float32)
+            grown[:count] = self._known_matrix
+            self._known_matrix = grown
+            
+            grown_norms = np.empty(2 * count, dtype=np.float32)
+            grown_norms[:count] = self._known_sq_norms
+            self._known_sq_norms = grown_norms
+        
+        self._known_matrix[count] = face_encoding
+        self._known_sq_norms[count] = self._known_matrix[count] @ self._known_matrix[count]
+        self.known_names.append(person_id)
+        
+        if self._ann_index is not None:
+            if count == self._ann_index.get_max_elements():
+                self._ann_index.resize_index(2 * count)
+            self._ann_index.add_items(self._known_matrix[count:count + 1], np.array([count]))
+        elif hnswlib is not None and count + 1 >= ANN_MIN_PERSONS:
+            self._build_ann_index()
+    
+    def _build_ann_index(self):
+        """Build an HNSW index over all known faces, labelled by row index."""
+        count = len(self.known_names)
+        self._ann_index = hnswlib.Index(space='l2', dim=ENCODING_DIM)
+        self._ann_index.init_index(max_elements=max(10_000, 2 * count), ef_construction=100, M=16)
+        self._ann_index.set_ef(50)
+        self._ann_index.add_items(self.known_faces, np.arange(count))
+        self.logger.info(f"Built nearest neighbor index over {count} known persons")
+    
+    def _check_dlib_build(self, require_simd: bool):
+        """Log the dlib build configuration and fail fast on a non-SIMD build."""
+        machine = platform.machine().lower()
+        if machine in ("x86_64", "amd64", "i386", "i686", "x86"):
+            simd_name, simd_flag, cpu_flags = "AVX", "USE_AVX_INSTRUCTIONS", ("avx",)
+            remedy = ("rebuild dlib from source with AVX enabled: "
+                      "python setup.py install --set USE_AVX_INSTRUCTIONS=1")
+        elif machine.startswith(("arm", "aarch64")):
+            simd_name, simd_flag, cpu_flags = "NEON", "USE_NEON_INSTRUCTIONS", ("neon", "asimd")
+            remedy = ("rebuild dlib from source with NEON enabled: "
+                      "python setup.py install --compiler-flags \"-mfpu=neon\"")
+        else:
+            simd_name, simd_flag, cpu_flags, remedy = None, None, (), None
+        
+        simd_enabled = getattr(dlib, simd_flag, None) if simd_flag else None
+        self.logger.info(
+            f"dlib {dlib.__version__} build: "
+            f"{simd_name or 'SIMD'}={simd_enabled}, "
+            f"CUDA={getattr(dlib, 'DLIB_USE_CUDA', None)}, "
+            f"BLAS={getattr(dlib, 'DLIB_USE_BLAS', None)}"
+        )
+        
+        # Older dlib builds do not expose the flag, so only act when it is known to be off
+        if simd_enabled is False:
+            # dlib enables SIMD by itself when the build host supports it, so a
+            # non-SIMD build often just means this CPU lacks the instructions;
+            # only refuse when a rebuild would actually run here
+            host_flags = self._host_cpu_flags()
+            host_supported = None if host_flags is None else any(flag in host_flags for flag in cpu_flags)
+            
+            if host_supported is False:
+                self.logger.warning(f"dlib was built without {simd_name} instructions, which this CPU "
+                                    f"does not support; face detection will be slower")
+                return
+            
+            message = (f"dlib was built without {simd_name} instructions, face detection "
+                       f"will be several times slower; {remedy}")
+            if require_simd and host_supported:
+                raise RuntimeError(f"{message} (or pass --allow_slow_dlib to run anyway)")
+            self.logger.warning(message)
+    
+    @staticmethod
+    def _host_cpu_flags() -> Optional[set]:
+        """Return the CPU feature flags from /proc/cpuinfo, or None if unavailable."""
+        try:
+            with open("/proc/cpuinfo", 'r') as f:
+                for line in f:
+                    # x86 lists them under "flags", ARM under "Features"
+                    key, _, value = line.partition(':')
+                    if key.strip().lower() in ("flags", "features"):
+                        return set(value.split())
+        except OSError:
+            pass
+        
+        return None
+    
     def _initialize_camera(self):
         """Initialize the webcam."""
         try:
             self.cap = cv2.VideoCapture(self.camera_id)
+            # Request MJPG before the frame size; it needs far less USB bandwidth than YUYV
+            self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
             self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
             self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+            # Ask the driver not to queue up stale frames
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
             
             if not self.cap.isOpened():
                 raise Exception("Could not open webcam")
@@ -97,42 +366,175 @@ class PersonTracker:
         # Load metadata if exists
         if os.path.exists(metadata_file):
             with open(metadata_file, 'r') as f:
-                self.person_metadata = json.load(f)
+                snapshot = json.load(f)
+            
+            # Snapshots nest the persons next to the last event sequence number;
+            # older files are a flat person -> metadata map
+            if isinstance(snapshot.get('persons'), dict):
+                self.person_metadata = snapshot['persons']
+                self._event_seq = snapshot.get('last_event_seq', 0)
+            else:
+                self.person_metadata = snapshot
+        
+        # Apply changes logged after the last snapshot
+        self._replay_events()
         
-        # Load known faces
-        for person_folder in os.listdir(self.database_path):
-            person_path = os.path.join(self.database_path, person_folder)
+        # Load known faces; scandir entries carry their file type, saving a stat per entry
+        with os.scandir(self.database_path) as entries:
+            person_entries = [entry for entry in entries
+                              if entry.name.startswith("Person_") and entry.is_dir(follow_symlinks=False)]
+        
+        # Encodings snapshotted on the last clean shutdown
+        cached_encodings = {}
+        encodings_mtime = 0.0
+        encodings_file = os.path.join(self.database_path, "encodings.npz")
+        if os.path.exists(encodings_file):
+            try:
+                encodings_mtime = os.path.getmtime(encodings_file)
+                with np.load(encodings_file) as data:
+                    cached_encodings = {person_id: data[person_id] for person_id in data.files}
+            except Exception as e:
+                self.logger.warning(f"Could not load cached encodings: {e}")
+        
+        for person_entry in person_entries:
+            person_id = person_entry.name
             
-            if os.path.isdir(person_path) and person_folder.startswith("Person_"):
-                person_id = person_folder
-                
-                # Load first image as reference
-                images = [f for f in os.listdir(person_path) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+            try:
+                person_num = int(person_id.split('_')[1])
                 
-                if images:
-                    ref_image_path = os.path.join(person_path, images[0])
+                # A person's encoding.npy is authoritative; the snapshot is only rewritten
+                # on clean shutdown, so ignore it if encoding.npy was written since
+                face_encoding = cached_encodings.get(person_id)
+                if face_encoding is not None:
                     try:
-                        reference_image = face_recognition.load_image_file(ref_image_path)
-                        face_encodings = face_recognition.face_encodings(reference_image)
-                        
-                        if face_encodings:
-                            self.known_faces.append(face_encodings[0])
-                            self.known_names.append(person_id)
-                            self.last_update_time[person_id] = 0
-                            
-                            # Update person count
-                            person_num = int(person_id.split('_')[1])
-                            self.person_count = max(self.person_count, person_num)
-                            
-                            self.logger.info(f"Loaded existing person: {person_id}")
-                    except Exception as e:
-                        self.logger.warning(f"Could not load reference image for {person_id}: {e}")
+                        if os.path.getmtime(os.path.join(person_entry.path, "encoding.npy")) >= encodings_mtime:
+                            face_encoding = None
+                    except FileNotFoundError:
+                        pass
+                
+                if face_encoding is None or face_encoding.shape != (ENCODING_DIM,):
+                    face_encoding = self._load_person_encoding(person_entry.path, person_id)
+                
+                if face_encoding is not None:
+                    self._add_known_face(face_encoding.astype(np.float32), person_id)
+                    self.last_update_time[person_id] = 0
+                    
+                    # Update person count
+                    self.person_count = max(self.person_count, person_num)
+                    
+                    self.logger.info(f"Loaded existing person: {person_id}")
+            except Exception as e:
+                self.logger.warning(f"Could not load person {person_id}: {e}")
+    
+    def _load_person_encoding(self, person_path: str, person_id: str) -> Optional[np.ndarray]:
+        """Load a person's encoding from encoding.npy, or compute it from the first image."""
+        encoding_file = os.path.join(person_path, "encoding.npy")
+        if os.path.exists(encoding_file):
+            try:
+                face_encoding = np.load(encoding_file)
+                if face_encoding.shape == (ENCODING_DIM,):
+                    return face_encoding
+                self.logger.warning(f"Cached encoding for {person_id} has shape {face_encoding.shape}, re-encoding")
+            except Exception as e:
+                self.logger.warning(f"Could not load cached encoding for {person_id}: {e}")
+        
+        # Load first image as reference, stopping at the first match
+        with os.scandir(person_path) as entries:
+            ref_image_path = next((entry.path for entry in entries
+                                   if entry.name.lower().endswith(('.jpg', '.jpeg', '.png'))
+                                   and entry.is_file()), None)
+        
+        if ref_image_path is not None:
+            try:
+                reference_image = face_recognition.load_image_file(ref_image_path)
+                face_encodings = face_recognition.face_encodings(reference_image)
+                
+                if face_encodings:
+                    # Cache it so the next startup skips the encoder
+                    face_encoding = face_encodings[0].astype(np.float32)
+                    np.save(encoding_file, face_encoding)
+                    return face_encoding
+            except Exception as e:
+                self.logger.warning(f"Could not load reference image for {person_id}: {e}")
+        
+        return None
+    
+    def _save_encodings(self):
+        """Snapshot all known encodings to encodings.npz for fast startup."""
+        encodings_file = os.path.join(self.database_path, "encodings.npz")
+        tmp_file = os.path.join(self.database_path, "encodings.tmp.npz")
+        np.savez(tmp_file, **dict(zip(self.known_names, self.known_faces)))
+        os.replace(tmp_file, encodings_file)
+    
+    def _replay_events(self):
+        """Apply metadata events logged since the last snapshot."""
+        events_file = os.path.join(self.database_path, "events.jsonl")
+        if not os.path.exists(events_file):
+            return
+        
+        snapshot_seq = self._event_seq
+        with open(events_file, 'r') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line from an interrupted write
+                    self.logger.warning("Skipping malformed metadata event")
+                    continue
+                
+                # Already in the snapshot if we stopped before truncating the log
+                seq = event.get('seq')
+                if seq is not None and seq <= snapshot_seq:
+                    continue
+                
+                self._apply_event(event)
+                self._events_since_snapshot += 1
+                if seq is not None:
+                    self._event_seq = max(self._event_seq, seq)
+    
+    def _apply_event(self, event: Dict):
+        """Apply a single metadata event to the in-memory metadata."""
+        person_id = event['id']
+        
+        if event['event'] == 'created':
+            self.person_metadata[person_id] = {
+                'created': event['t'],
+                'total_images': 0,
+                'last_seen': event['t']
+            }
+        elif event['event'] == 'image' and person_id in self.person_metadata:
+            self.person_metadata[person_id]['total_images'] += 1
+            self.person_metadata[person_id]['last_seen'] = event['t']
+    
+    def _record_event(self, event: Dict):
+        """Apply a metadata event and append it to the event log."""
+        with self._metadata_lock:
+            self._event_seq += 1
+            event['seq'] = self._event_seq
+            self._apply_event(event)
+            
+            self._events_file.write(json.dumps(event) + '\n')
+            self._events_since_snapshot += 1
+            
+            if self._events_since_snapshot >= SNAPSHOT_EVERY:
+                self._save_metadata()
     
     def _save_metadata(self):
-        """Save person metadata to JSON file."""
-        metadata_file = os.path.join(self.database_path, "metadata.json")
-        with open(metadata_file, 'w') as f:
-            json.dump(self.person_metadata, f, indent=2)
+        """Snapshot person metadata to JSON file and reset the event log."""
+        with self._metadata_lock:
+            metadata_file = os.path.join(self.database_path, "metadata.json")
+            
+            # Write to a temporary file first so a crash never leaves a partial snapshot
+            tmp_file = metadata_file + ".tmp"
+            with open(tmp_file, 'w') as f:
+                json.dump({'last_event_seq': self._event_seq, 'persons': self.person_metadata}, f, indent=2)
+            os.replace(tmp_file, metadata_file)
+            
+            # The snapshot now covers every logged event
+            if self._events_file is not None:
+                self._events_file.seek(0)
+                self._events_file.truncate()
+            self._events_since_snapshot = 0
     
     def _create_person_folder(self, person_id: str) -> str:
         """Create folder for new person."""
@@ -140,17 +542,12 @@ class PersonTracker:
         os.makedirs(person_folder, exist_ok=True)
         
         # Initialize metadata
-        self.person_metadata[person_id] = {
-            'created': datetime.now().isoformat(),
-            'total_images': 0,
-            'last_seen': datetime.now().isoformat()
-        }
+        self._record_event({'event': 'created', 'id': person_id, 't': datetime.now().isoformat()})
         
-        self._save_metadata()
         return person_folder
     
-    def _save_person_image(self, frame: np.ndarray, face_location: Tuple, person_id: str) -> str:
-        """Save image of detected person."""
+    def _save_person_image(self, frame: np.ndarray, face_location: Tuple, person_id: str):
+        """Queue an image of a detected person for the writer thread."""
         # Extract face region with some padding
         top, right, bottom, left = face_location
         padding = 50
@@ -174,55 +571,151 @@ class PersonTracker:
         if not os.path.exists(person_folder):
             person_folder = self._create_person_folder(person_id)
         
-        # Save image
+        # Queue the image for the writer thread; copy so the crop does not pin the frame.
+        # The metadata event is only recorded once the image is actually written.
         filepath = os.path.join(person_folder, filename)
-        cv2.imwrite(filepath, face_image)
+        event = {'event': 'image', 'id': person_id, 'file': filepath,
+                 't': datetime.now().isoformat()}
+        self._queue_image_write(filepath, face_image.copy(), event)
+    
+    def _queue_image_write(self, filepath: str, image: np.ndarray, event: Dict):
+        """Queue an image for writing, dropping the oldest pending one if full."""
+        while True:
+            try:
+                self._save_queue.put_nowait((filepath, image, event))
+                return
+            except queue.Full:
+                try:
+                    dropped_path, _, _ = self._save_queue.get_nowait()
+                    self.logger.warning(f"Image write queue full, dropped: {dropped_path}")
+                except queue.Empty:
+                    pass
+    
+    def _writer_loop(self):
+        """Writer thread: encode and save queued images until a None sentinel."""
+        while True:
+            item = self._save_queue.get()
+            if item is None:
+                break
+            
+            filepath, image, event = item
+            try:
+                saved = cv2.imwrite(filepath, image, [cv2.IMWRITE_JPEG_QUALITY, 85])
+            except cv2.error as e:
+                self.logger.error(f"Failed to save image {filepath}: {e}")
+                continue
+            
+            if saved:
+                self._record_event(event)
+                self.logger.info(f"Saved image: {filepath}")
+            else:
+                self.logger.error(f"Failed to save image: {filepath}")
+    
+    def _detect_faces(self, frame: np.ndarray) -> Tuple[List, np.ndarray]:
+        """Detect faces in the frame and return locations and an (M, 128) float32 encoding matrix."""
+        # Locate faces on a downscaled copy, detection cost scales with pixel count
+        height, width = frame.shape[:2]
+        small_size = (int(round(width * self.detection_scale)), int(round(height * self.detection_scale)))
+        if self._small_buf is None or self._small_buf.shape[1::-1] != small_size:
+            self._small_buf = np.empty((small_size[1], small_size[0], 3), dtype=np.uint8)
+            self._gray_buf = np.empty((small_size[1], small_size[0]), dtype=np.uint8)
+            self._rgb_buf = np.empty_like(self._small_buf)
+        small_frame = cv2.resize(frame, small_size, dst=self._small_buf)
         
-        # Update metadata
-        if person_id in self.person_metadata:
-            self.person_metadata[person_id]['total_images'] += 1
-            self.person_metadata[person_id]['last_seen'] = datetime.now().isoformat()
-            self._save_metadata()
+        if self._hog_detector is not None:
+            # HOG on a single grayscale channel, upsampling once like face_recognition does
+            small_gray = cv2.cvtColor(small_frame, cv2.COLOR_BGR2GRAY, dst=self._gray_buf)
+            small_locations = [self._rect_to_css(rect, small_gray.shape)
+                               for rect in self._hog_detector(small_gray, 1)]
+        else:
+            small_rgb = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB, dst=self._rgb_buf)
+            small_locations = face_recognition.face_locations(small_rgb, model=self.face_detection_model)
+        
+        # Map locations back to full resolution as an (N, 4) array
+        location_array = np.rint(np.asarray(small_locations, dtype=np.float64).reshape(-1, 4)
+                                 / self.detection_scale).astype(np.int32)
+        
+        # Filter faces by minimum size (in full resolution pixels) before encoding them
+        face_heights = location_array[:, 2] - location_array[:, 0]
+        face_widths = location_array[:, 1] - location_array[:, 3]
+        keep = (face_widths >= self.min_face_size[0]) & (face_heights >= self.min_face_size[1])
+        filtered_locations = [tuple(location) for location in location_array[keep].tolist()]
         
-        self.logger.info(f"Saved image: {filepath}")
-        return filepath
+        # dlib produces float64; float32 halves the bytes moved by identification
+        # and is far more precise than the similarity threshold needs
+        filtered_encodings = np.asarray([self._encode_face(frame, location) for location in filtered_locations],
+                                        dtype=np.float32).reshape(-1, ENCODING_DIM)
+        
+        return filtered_locations, filtered_encodings
     
-    def _detect_faces(self, frame: np.ndarray) -> Tuple[List, List]:
-        """Detect faces in the frame and return locations and encodings."""
-        # Convert BGR to RGB
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    @staticmethod
+    def _rect_to_css(rect, shape: Tuple) -> Tuple[int, int, int, int]:
+        """Convert a dlib rectangle to a (top, right, bottom, left) tuple within shape."""
+        return (max(rect.top(), 0), min(rect.right(), shape[1]),
+                min(rect.bottom(), shape[0]), max(rect.left(), 0))
+    
+    def _encode_face(self, frame: np.ndarray, face_location: Tuple) -> np.ndarray:
+        """Encode a single face from a crop around its location in the BGR frame."""
+        top, right, bottom, left = face_location
         
-        # Find face locations and encodings
-        face_locations = face_recognition.face_locations(rgb_frame, model=self.face_detection_model)
-        face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+        # Keep a margin of half the face size: the aligned 150x150 chip dlib encodes
+        # reaches past the detection box
+        margin = max(right - left, bottom - top) // 2
+        height, width = frame.shape[:2]
+        crop_top = max(0, top - margin)
+        crop_left = max(0, left - margin)
+        crop = frame[crop_top:min(height, bottom + margin), crop_left:min(width, right + margin)]
         
-        # Filter faces by minimum size
-        filtered_locations = []
-        filtered_encodings = []
+        # Convert only the crop to RGB and encode with the location relative to it
+        rgb_crop = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
+        crop_location = (top - crop_top, right - crop_left, bottom - crop_top, left - crop_left)
+        return face_recognition.face_encodings(rgb_crop, [crop_location], num_jitters=1, model="small")[0]
+    
+    def _identify_batch(self, face_encodings: np.ndarray) -> List[Optional[str]]:
+        """Identify persons for an (M, 128) batch of face encodings."""
+        if not self.known_names or len(face_encodings) == 0:
+            return [None] * len(face_encodings)
         
-        for location, encoding in zip(face_locations, face_encodings):
-            top, right, bottom, left = location
-            face_width = right - left
-            face_height = bottom - top
+        count = len(self.known_names)
+        encodings = np.ascontiguousarray(face_encodings, dtype=np.float32)
+        
+        if self._ann_index is not None:
+            # Approximate nearest neighbor, then verify it with the exact distance
+            labels, _ = self._ann_index.knn_query(encodings, k=1)
+            best_match_indices = labels[:, 0].astype(np.intp)
+            diffs = self.known_faces[best_match_indices] - encodings
+            best_distances_sq = np.einsum('ij,ij->i', diffs, diffs)
+        else:
+            if _squared_distances is not None:
+                # JIT-compiled kernel, vectorized over the encoding and parallel over known faces
+                distances_sq = _squared_distances(self.known_faces, encodings)
+            else:
+                # Squared euclidean distances between all known faces and all encodings as
+                # ||k||^2 + ||e||^2 - 2 K.E^T, so the only O(N*M) work is one BLAS GEMM
+                distances_sq = (self._known_sq_norms[:count, None]
+                                + np.einsum('ij,ij->i', encodings, encodings)[None, :]
+                                - 2 * (self.known_faces @ encodings.T))
             
-            if face_width >= self.min_face_size[0] and face_height >= self.min_face_size[1]:
-                filtered_locations.append(location)
-                filtered_encodings.append(encoding)
+            best_match_indices = distances_sq.argmin(axis=0)
+            best_distances_sq = distances_sq[best_match_indices, np.arange(len(encodings))]
         
-        return filtered_locations, filtered_encodings
+        matched = best_distances_sq < self.similarity_threshold ** 2
+        
+        return [self.known_names[index] if is_match else None
+                for index, is_match in zip(best_match_indices, matched)]
     
-    def _identify_person(self, face_encoding: np.ndarray) -> Optional[str]:
-        """Identify person based on face encoding."""
-        if not self.known_faces:
+    def _identify_among_new(self, face_encoding: np.ndarray, first_new_index: int) -> Optional[str]:
+        """Match an encoding against the known faces from first_new_index onwards."""
+        new_faces = self.known_faces[first_new_index:]
+        if not len(new_faces):
             return None
         
-        # Compare with known faces
-        distances = face_recognition.face_distance(self.known_faces, face_encoding)
-        min_distance = np.min(distances)
+        diffs = new_faces - face_encoding
+        distances_sq = np.einsum('ij,ij->i', diffs, diffs)
+        best_match_index = int(distances_sq.argmin())
         
-        if min_distance < self.similarity_threshold:
-            best_match_index = np.argmin(distances)
-            return self.known_names[best_match_index]
+        if distances_sq[best_match_index] < self.similarity_threshold ** 2:
+            return self.known_names[first_new_index + best_match_index]
         
         return None
     
@@ -231,9 +724,10 @@ class PersonTracker:
         self.person_count += 1
         person_id = f"Person_{self.person_count}"
         
-        # Add to known faces
-        self.known_faces.append(face_encoding)
-        self.known_names.append(person_id)
+        # Add to known faces and cache the encoding next to the person's images
+        self._add_known_face(face_encoding, person_id)
+        person_folder = self._create_person_folder(person_id)
+        np.save(os.path.join(person_folder, "encoding.npy"), face_encoding.astype(np.float32))
         self.last_update_time[person_id] = time.time()
         
         self.logger.info(f"Registered new person: {person_id}")
@@ -262,57 +756,174 @@ class PersonTracker:
         
         return frame
     
+    @staticmethod
+    def _create_box_tracker():
+        """Create an OpenCV object tracker, preferring KCF when available."""
+        # KCF ships with opencv-contrib-python (see requirements.txt); MIL is a slower
+        # fallback for installs that only have the main opencv-python package
+        factory = getattr(cv2, "TrackerKCF_create", None) or cv2.TrackerMIL_create
+        return factory()
+    
+    def _reset_trackers(self, frame: np.ndarray, face_locations: List, person_ids: List):
+        """Re-initialize box trackers from the faces detected in frame."""
+        self._trackers = []
+        for (top, right, bottom, left), person_id in zip(face_locations, person_ids):
+            tracker = self._create_box_tracker()
+            tracker.init(frame, (left, top, right - left, bottom - top))
+            self._trackers.append((person_id, tracker))
+    
+    def _update_trackers(self, frame: np.ndarray) -> Tuple[List, List]:
+        """Advance all box trackers to frame and return locations and ids."""
+        face_locations = []
+        person_ids = []
+        active_trackers = []
+        
+        for person_id, tracker in self._trackers:
+            ok, (x, y, w, h) = tracker.update(frame)
+            if not ok:
+                # Lost track; the face will be picked up again on the next detection
+                continue
+            
+            x, y, w, h = int(x), int(y), int(w), int(h)
+            face_locations.append((y, x + w, y + h, x))
+            person_ids.append(person_id)
+            active_trackers.append((person_id, tracker))
+        
+        self._trackers = active_trackers
+        return face_locations, person_ids
+    
+    @staticmethod
+    def _put_latest(slot: queue.Queue, item):
+        """Put item into a single-slot queue, dropping any stale item."""
+        try:
+            slot.get_nowait()
+        except queue.Empty:
+            pass
+        
+        try:
+            slot.put_nowait(item)
+        except queue.Full:
+            pass
+    
+    def _process_frame(self, frame: np.ndarray) -> Tuple[List, List]:
+        """Detect, identify and save persons in a frame; return locations and ids."""
+        # Detect faces
+        face_locations, face_encodings = self._detect_faces(frame)
+        
+        # Try to identify all faces at once
+        matches = self._identify_batch(face_encodings)
+        
+        # Rows of the known faces matrix registered while processing this frame
+        first_new_index = len(self.known_names)
+        person_ids = []
+        
+        # Process each detected face
+        for face_location, face_encoding, person_id in zip(face_locations, face_encodings, matches):
+            # The batch lookup could not see persons registered earlier in this frame
+            if person_id is None:
+                person_id = self._identify_among_new(face_encoding, first_new_index)
+            
+            # If unknown person, register them
+            if person_id is None:
+                person_id = self._register_new_person(face_encoding)
+                # Save first image immediately
+                self._save_person_image(frame, face_location, person_id)
+            else:
+                # Check if we should update existing person
+                if self._should_update_person(person_id):
+                    self._save_person_image(frame, face_location, person_id)
+                    self.last_update_time[person_id] = time.time()
+            
+            person_ids.append(person_id)
+        
+        return face_locations, person_ids
+    
+    def _detection_loop(self):
+        """Worker thread: process the most recent frame until stopped."""
+        while not self._stop_event.is_set():
+            try:
+                frame = self._frame_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            
+            try:
+                results = self._process_frame(frame)
+            except Exception as e:
+                self.logger.error(f"Error during detection: {e}")
+                self._stop_event.set()
+                break
+            
+            self._put_latest(self._result_queue, (frame, *results))
+    
+    def _track_frame(self, frame: np.ndarray, show_preview: bool):
+        """Schedule detection, advance face boxes and render a single frame."""
+        # Hand every N-th frame to the detection thread, replacing any unprocessed one
+        if self.frame_idx % self.detect_every == 0:
+            self._put_latest(self._frame_queue, frame)
+        self.frame_idx += 1
+        
+        # Re-seed trackers from fresh detections, then move the boxes to this frame
+        try:
+            detected_frame, detected_locations, detected_ids = self._result_queue.get_nowait()
+            self._reset_trackers(detected_frame, detected_locations, detected_ids)
+        except queue.Empty:
+            pass
+        
+        face_locations, person_ids = self._update_trackers(frame)
+        
+        # Show preview if enabled
+        if show_preview:
+            # Draw on a reused canvas; the frame itself may still be in use by the detector
+            if self._display_buf is None or self._display_buf.shape != frame.shape:
+                self._display_buf = np.empty_like(frame)
+            np.copyto(self._display_buf, frame)
+            display_frame = self._draw_detections(self._display_buf, face_locations, person_ids)
+            
+            # Add system info
+            info_text = f"Tracked Persons: {len(self.known_names)} | Press 'q' to quit"
+            cv2.putText(display_frame, info_text, (10, 30), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+            
+            cv2.imshow('Person Tracker', display_frame)
+    
     def start_tracking(self, show_preview: bool = True):
         """Start the real-time tracking system."""
         self.logger.info("Starting person tracking system...")
         
+        self._stop_event.clear()
+        self._detection_thread = threading.Thread(target=self._detection_loop,
+                                                  name="face-detection", daemon=True)
+        self._detection_thread.start()
+        
+        self._writer_thread = threading.Thread(target=self._writer_loop,
+                                               name="image-writer", daemon=True)
+        self._writer_thread.start()
+        
+        # Frames are read on their own thread so a slow iteration never sees stale frames
+        self._grabber = FrameGrabber(self.cap)
+        self._grabber.start()
+        
+        self.frame_idx = 0
+        self._trackers = []
+        frame_id = 0
+        
+        # With a preview, wake up often enough to keep the window responsive
+        # even if the camera stalls; headless, just block until a new frame
+        frame_timeout = 0.03 if show_preview else 0.5
+        
         try:
-            while True:
-                ret, frame = self.cap.read()
-                if not ret:
+            while not self._stop_event.is_set():
+                frame, frame_id = self._grabber.read(frame_id, timeout=frame_timeout)
+                if frame is None and self._grabber.failed:
                     self.logger.error("Failed to read frame from camera")
                     break
                 
-                # Detect faces
-                face_locations, face_encodings = self._detect_faces(frame)
+                if frame is not None:
+                    self._track_frame(frame, show_preview)
                 
-                person_ids = []
-                
-                # Process each detected face
-                for face_location, face_encoding in zip(face_locations, face_encodings):
-                    # Try to identify person
-                    person_id = self._identify_person(face_encoding)
-                    
-                    # If unknown person, register them
-                    if person_id is None:
-                        person_id = self._register_new_person(face_encoding)
-                        # Save first image immediately
-                        self._save_person_image(frame, face_location, person_id)
-                    else:
-                        # Check if we should update existing person
-                        if self._should_update_person(person_id):
-                            self._save_person_image(frame, face_location, person_id)
-                            self.last_update_time[person_id] = time.time()
-                    
-                    person_ids.append(person_id)
-                
-                # Show preview if enabled
-                if show_preview:
-                    display_frame = self._draw_detections(frame.copy(), face_locations, person_ids)
-                    
-                    # Add system info
-                    info_text = f"Tracked Persons: {len(self.known_names)} | Press 'q' to quit"
-                    cv2.putText(display_frame, info_text, (10, 30), 
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-                    
-                    cv2.imshow('Person Tracker', display_frame)
-                    
-                    # Check for quit
-                    if cv2.waitKey(1) & 0xFF == ord('q'):
-                        break
-                
-                # Small delay to prevent excessive CPU usage
-                time.sleep(0.1)
+                # waitKey pumps the preview window's events and doubles as the quit check
+                if show_preview and cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
         
         except KeyboardInterrupt:
             self.logger.info("Tracking stopped by user")
@@ -325,18 +936,43 @@ class PersonTracker:
         """Clean up resources."""
         self.logger.info("Cleaning up resources...")
         
+        # Stop the detection thread before releasing the camera
+        self._stop_event.set()
+        if self._detection_thread is not None:
+            self._detection_thread.join()
+            self._detection_thread = None
+        
+        if self._grabber is not None:
+            if not self._grabber.stop():
+                self.logger.warning("Frame grabber did not stop, camera read appears to be stuck")
+            self._grabber = None
+        
+        # Let the writer thread flush pending images
+        if self._writer_thread is not None:
+            self._save_queue.put(None)
+            self._writer_thread.join()
+            self._writer_thread = None
+        
         if self.cap:
             self.cap.release()
         
         cv2.destroyAllWindows()
         
-        # Save final metadata
+        # Save final metadata and encoding snapshots
         self._save_metadata()
+        self._save_encodings()
+        if self._events_file is not None:
+            self._events_file.close()
+            self._events_file = None
         
         self.logger.info("Cleanup completed")
     
-    def get_statistics(self) -> Dict:
-        """Get tracking statistics."""
+    def get_statistics(self, rescan: bool = False) -> Dict:
+        """Get tracking statistics.
+        
+        Image counts come from the in-memory metadata; pass rescan=True to
+        count the image files on disk instead.
+        """
         stats = {
             'total_persons': len(self.known_names),
             'database_path': self.database_path,
@@ -344,18 +980,90 @@ class PersonTracker:
         }
         
         for person_id in self.known_names:
-            person_folder = os.path.join(self.database_path, person_id)
-            if os.path.exists(person_folder):
-                images = [f for f in os.listdir(person_folder) 
-                         if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-                stats['persons'][person_id] = {
-                    'total_images': len(images),
-                    'metadata': self.person_metadata.get(person_id, {})
-                }
+            metadata = self.person_metadata.get(person_id, {})
+            
+            if rescan:
+                person_folder = os.path.join(self.database_path, person_id)
+                if not os.path.isdir(person_folder):
+                    continue
+                with os.scandir(person_folder) as entries:
+                    total_images = sum(1 for entry in entries
+                                       if entry.name.lower().endswith(('.jpg', '.jpeg', '.png')))
+            else:
+                total_images = metadata.get('total_images', 0)
+            
+            stats['persons'][person_id] = {
+                'total_images': total_images,
+                'metadata': metadata
+            }
         
         return stats
 
-def main():    """Main function to run the person tracking system."""    parser = argparse.ArgumentParser(description="Real-Time Person Detection and Tracking System.")    parser.add_argument("--camera_id", type=int, default=0, help="ID of the webcam to use.")    parser.add_argument("--database_path", type=str, default="./database", help="Path to store person folders.")    parser.add_argument("--update_interval", type=int, default=300, help="Time in seconds between image updates for same person.")    parser.add_argument("--similarity_threshold", type=float, default=0.6, help="Face similarity threshold (lower = more strict).")    parser.add_argument("--min_face_size", type=str, default="(50, 50)", help="Minimum face size to detect (width, height) e.g., "(50, 50)".")    parser.add_argument("--detection_confidence", type=float, default=0.8, help="Minimum confidence for face detection.")    parser.add_argument("--face_detection_model", type=str, default="hog", choices=["hog", "cnn"], help="Face detection model to use ('hog' or 'cnn').")    parser.add_argument("--no_preview", action="store_true", help="Do not show the real-time video preview.")    args = parser.parse_args()    # Convert min_face_size string to tuple    try:        min_face_size_tuple = tuple(map(int, args.min_face_size.strip('()').split(',')))        if len(min_face_size_tuple) != 2:            raise ValueError    except ValueError:        print(f"Error: Invalid format for --min_face_size. Please use "(width, height)" (e.g., "(50, 50)").")        return 1    print("Person Detection and Tracking System")    print("===================================")        try:        tracker = PersonTracker(            camera_id=args.camera_id,            database_path=args.database_path,            update_interval=args.update_interval,            similarity_threshold=args.similarity_threshold,            min_face_size=min_face_size_tuple,            detection_confidence=args.detection_confidence,            face_detection_model=args.face_detection_model        )                print(f"Database Path: {args.database_path}")        print(f"Update Interval: {args.update_interval} seconds")        print(f"Similarity Threshold: {args.similarity_threshold}")        print(f"Min Face Size: {min_face_size_tuple}")        print(f"Detection Confidence: {args.detection_confidence}")        print(f"Face Detection Model: {args.face_detection_model}")        print("\nStarting tracking... Press 'q' in the video window to quit.")                tracker.start_tracking(show_preview=not args.no_preview)                stats = tracker.get_statistics()        print(f"\nFinal Statistics:")        print(f"Total Persons Tracked: {stats['total_persons']}")        for person_id, data in stats['persons'].items():            print(f"  {person_id}: {data['total_images']} images")        except Exception as e:        print(f"Error: {e}")        return 1        return 0
+def main():
+    """Main function to run the person tracking system."""
+    parser = argparse.ArgumentParser(description="Real-Time Person Detection and Tracking System.")
+    parser.add_argument("--camera_id", type=int, default=0, help="ID of the webcam to use.")
+    parser.add_argument("--database_path", type=str, default="./database", help="Path to store person folders.")
+    parser.add_argument("--update_interval", type=int, default=300, help="Time in seconds between image updates for same person.")
+    parser.add_argument("--similarity_threshold", type=float, default=0.6, help="Face similarity threshold (lower = more strict).")
+    parser.add_argument("--min_face_size", type=str, default="(50, 50)", help="Minimum face size to detect (width, height) e.g., '(50, 50)'.")
+    parser.add_argument("--detection_confidence", type=float, default=0.8, help="Minimum confidence for face detection.")
+    parser.add_argument("--face_detection_model", type=str, default="auto", choices=["auto", "hog", "cnn"], help="Face detection model to use ('hog', 'cnn', or 'auto' to use 'cnn' when dlib has CUDA).")
+    parser.add_argument("--detection_scale", type=float, default=0.5, help="Factor to resize frames by before face detection (1.0 = full resolution).")
+    parser.add_argument("--detect_every", type=int, default=5, help="Run face detection on every N-th frame and track faces in between.")
+    parser.add_argument("--allow_slow_dlib", action="store_true", help="Run even if dlib was built without AVX/NEON instructions.")
+    parser.add_argument("--no_preview", action="store_true", help="Do not show the real-time video preview.")
+    args = parser.parse_args()
+
+    # Convert min_face_size string to tuple
+    try:
+        min_face_size_tuple = tuple(map(int, args.min_face_size.strip('()').split(',')))
+        if len(min_face_size_tuple) != 2:
+            raise ValueError
+    except ValueError:
+        print("Error: Invalid format for --min_face_size. Please use '(width, height)' (e.g., '(50, 50)').")
+        return 1
+
+    print("Person Detection and Tracking System")
+    print("===================================")
+    
+    try:
+        tracker = PersonTracker(
+            camera_id=args.camera_id,
+            database_path=args.database_path,
+            update_interval=args.update_interval,
+            similarity_threshold=args.similarity_threshold,
+            min_face_size=min_face_size_tuple,
+            detection_confidence=args.detection_confidence,
+            face_detection_model=args.face_detection_model,
+            detection_scale=args.detection_scale,
+            require_simd_dlib=not args.allow_slow_dlib,
+            detect_every=args.detect_every
+        )
+        
+        print(f"Database Path: {args.database_path}")
+        print(f"Update Interval: {args.update_interval} seconds")
+        print(f"Similarity Threshold: {args.similarity_threshold}")
+        print(f"Min Face Size: {min_face_size_tuple}")
+        print(f"Detection Confidence: {args.detection_confidence}")
+        print(f"Face Detection Model: {tracker.face_detection_model}")
+        print(f"Detection Scale: {args.detection_scale}")
+        print(f"Detect Every: {args.detect_every} frames")
+        print("\nStarting tracking... Press 'q' in the video window to quit.")
+        
+        tracker.start_tracking(show_preview=not args.no_preview)
+        
+        stats = tracker.get_statistics()
+        print(f"\nFinal Statistics:")
+        print(f"Total Persons Tracked: {stats['total_persons']}")
+        for person_id, data in stats['persons'].items():
+            print(f"  {person_id}: {data['total_images']} images")
+    
+    except Exception as e:
+        print(f"Error: {e}")
+        return 1
+    
+    return 0
 
 if __name__ == "__main__":
     exit(main())